@@ -5,14 +5,27 @@ import asyncio
 import logging
 import os
 import re
+import shutil
+import sys
 import tempfile
+import time
 import gzip
+import zipfile
+import zlib
+import io
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Iterator
 from urllib.parse import urlparse
 
+import aiofiles
 import aiohttp
-import pandas as pd
+from aiolimiter import AsyncLimiter
+import lxml.etree as LET
+import openpyxl
+import orjson
 from dotenv import load_dotenv
-from telegram import Update, Document
+from telegram import Update, Document, File
 from telegram.constants import ChatAction
 from telegram.ext import (
     Application,
@@ -21,7 +34,19 @@ from telegram.ext import (
     ContextTypes,
     filters,
 )
-import xml.etree.ElementTree as ET
+
+# Đọc .xlsx bằng calamine (Rust) nếu có, fallback openpyxl read_only nếu chưa cài
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
+# DNS bất đồng bộ qua c-ares nếu có aiodns, tránh threadpool getaddrinfo
+try:
+    import aiodns  # noqa: F401
+    HAS_AIODNS = True
+except ImportError:
+    HAS_AIODNS = False
 
 # =========================
 # Config & Logging
@@ -36,6 +61,14 @@ ONEHPING_API_URL = "https://app.1hping.com/external/api/campaign/create?culture=
 SKIP_SSL_VERIFY = os.getenv("SKIP_SSL_VERIFY", "false").lower() == "true"
 CRAWLER_UA = os.getenv("CRAWLER_UA", "1hping-indexbot/1.0 (+https://app.1hping.com)")
 BATCH_SIZE = int(os.getenv("BATCH_SIZE", "2000"))  # batch URL gửi mỗi campaign
+ONEHPING_CONCURRENCY = int(os.getenv("ONEHPING_CONCURRENCY", "4"))  # số batch gửi 1hping song song
+SITEMAP_CONCURRENCY = int(os.getenv("SITEMAP_CONCURRENCY", "16"))  # số sitemap tải song song mỗi lệnh
+SITEMAP_HOST_RATE = float(os.getenv("SITEMAP_HOST_RATE", "10"))  # số request/giây tối đa mỗi host
+SITEMAP_GLOBAL_CONCURRENCY = int(os.getenv("SITEMAP_GLOBAL_CONCURRENCY", "32"))  # trần chung toàn bot
+SITEMAP_MAX_URLS = int(os.getenv("SITEMAP_MAX_URLS", "200000"))  # trần số URL gom mỗi lệnh
+SITEMAP_MAX_SITEMAPS = int(os.getenv("SITEMAP_MAX_SITEMAPS", "5000"))  # trần số sitemap tải mỗi lệnh
+# Nameserver cho aiodns, vd "1.1.1.1,8.8.8.8"; để trống = dùng cấu hình DNS hệ thống
+DNS_NAMESERVERS = [ns.strip() for ns in os.getenv("DNS_NAMESERVERS", "").split(",") if ns.strip()]
 
 if not TELEGRAM_BOT_TOKEN:
     raise RuntimeError("Missing TELEGRAM_BOT_TOKEN in environment.")
@@ -48,26 +81,136 @@ logging.basicConfig(
 )
 logger = logging.getLogger("1hping-bot")
 
+# =========================
+# Regex biên dịch sẵn
+# =========================
+# Một lượt: nhóm 1 = chuỗi khoảng trắng (-> " "), còn lại = ký tự không cho phép (-> "")
+_SANITIZE_RE = re.compile(r"(\s+)|[^A-Za-z0-9 _\-\.\(\)\[\]\s]+")
+_URL_RE = re.compile(r"https?://[^\s<>\"\']+", re.I)
+_URL_VALID_RE = re.compile(r"^https?://[^/?#\s]+", re.I)
+_SCHEME_RE = re.compile(r"^https?://", re.I)
+_DAYS4_RE = re.compile(r"\d{1,4}")
+_SPLIT_RE = re.compile(r"[,\n\r]+")
+_LOC_RE = re.compile(rb"<loc(?:\s[^>]*)?>\s*([^<\s]+)\s*</loc>")
+# Entity hợp lệ trong XML: 5 entity định sẵn + tham chiếu ký tự số
+_XML_ENTITY_RE = re.compile(r"&(?:(amp|lt|gt|quot|apos)|#([0-9]+)|#[xX]([0-9a-fA-F]+));")
+_XML_BARE_AMP_RE = re.compile(r"&(?!(?:amp|lt|gt|quot|apos|#[0-9]+|#[xX][0-9a-fA-F]+);)")
+# Bản bytes cho fallback: nhóm 1 = khối CDATA (giữ nguyên, '&' trong CDATA là chữ thường)
+_XML_BARE_AMP_BYTES_RE = re.compile(rb"(<!\[CDATA\[.*?\]\]>)|" + _XML_BARE_AMP_RE.pattern.encode(), re.S)
+_XML_NAMED_ENTITIES = {"amp": "&", "lt": "<", "gt": ">", "quot": '"', "apos": "'"}
+_ROBOTS_SITEMAP_RE = re.compile(r"^\s*Sitemap:\s*(\S+)", re.I | re.M)
+# Text node .xlsx (<t> shared/inline string, <v> giá trị, có thể kèm prefix như <x:t>) chứa "://";
+# không khớp xmlns="http://..." hay <vt:lpstr> trong docProps
+_XLSX_URL_TEXT_RE = re.compile(rb"<(?:[A-Za-z_][\w.-]*:)?(?:t|v)\b[^>]*>[^<]*://")
+
 # =========================
 # Helpers chung
 # =========================
+@lru_cache(maxsize=1024)
 def sanitize_campaign_name(name: str) -> str:
     """Loại bỏ ký tự lạ, rút gọn chiều dài cho an toàn API."""
-    name = re.sub(r"\s+", " ", name).strip()
-    name = re.sub(r"[^A-Za-z0-9 _\-\.\(\)\[\]]+", "", name)
+    name = _SANITIZE_RE.sub(lambda m: " " if m.group(1) else "", name).strip()
     return name[:120] if len(name) > 120 else name
 
 def _chunk(lst, size):
     for i in range(0, len(lst), size):
         yield lst[i:i + size]
 
+def _get_session(context: ContextTypes.DEFAULT_TYPE) -> aiohttp.ClientSession:
+    """Lấy ClientSession dùng chung (tạo trong post_init) để tái sử dụng kết nối keep-alive."""
+    return context.application.bot_data["session"]
+
 async def send_typing(context: ContextTypes.DEFAULT_TYPE, chat_id: int):
     await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
 
+def send_typing_bg(context: ContextTypes.DEFAULT_TYPE, chat_id: int):
+    """Gửi typing kiểu fire-and-forget để chạy song song với việc chính, không tốn thêm 1 RTT."""
+    context.application.create_task(send_typing(context, chat_id))
+
+# ===== Trạng thái phiên: danh sách URL lưu ra file tạm, user_data chỉ giữ đường dẫn =====
+# Chỉ tách/nối bằng "\n" (newline="" để không dịch \r); splitlines() còn tách cả
+# \x1c-\x1e, \x85, \u2028... vốn có thể nằm lọt trong URL từ sitemap.
+# File nằm trong thư mục tạm riêng của tiến trình (tạo ở post_init, xoá ở post_shutdown)
+_URLS_TMP_PREFIX = "1hping_urls_"
+
+def _write_urls_file(urls: list[str], urls_dir: str) -> str:
+    with tempfile.NamedTemporaryFile(
+        "w", delete=False, dir=urls_dir, prefix=_URLS_TMP_PREFIX, suffix=".txt", encoding="utf-8", newline=""
+    ) as tf:
+        tf.write("\n".join(urls))
+    return tf.name
+
+def _read_urls_file(path: str) -> list[str]:
+    with open(path, encoding="utf-8", newline="") as f:
+        data = f.read()
+    return data.split("\n") if data else []
+
+async def _store_urls(context: ContextTypes.DEFAULT_TYPE, urls: list[str]):
+    _drop_urls_file(context)
+    # Ghi tới ~200k URL: đẩy sang thread để không chặn event loop
+    urls_dir = context.application.bot_data["urls_dir"].name
+    context.user_data["urls_file"] = await asyncio.to_thread(_write_urls_file, urls, urls_dir)
+
+async def _load_urls(context: ContextTypes.DEFAULT_TYPE) -> list[str]:
+    path = context.user_data.get("urls_file")
+    if not path:
+        return []
+    try:
+        return await asyncio.to_thread(_read_urls_file, path)
+    except OSError:
+        return []
+
+def _drop_urls_file(context: ContextTypes.DEFAULT_TYPE):
+    path = context.user_data.pop("urls_file", None)
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def _sweep_stale_urls_files():
+    """
+    Xoá file/thư mục URL tạm bỏ lại từ lần chạy trước (user_data không persist nên
+    không ai còn trỏ tới chúng; tiến trình bị kill thì post_shutdown không chạy).
+    """
+    tmp = tempfile.gettempdir()
+    try:
+        names = [n for n in os.listdir(tmp) if n.startswith(_URLS_TMP_PREFIX)]
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(tmp, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def _clear_session(context: ContextTypes.DEFAULT_TYPE):
+    _drop_urls_file(context)
+    context.user_data.clear()
+
 def _short(obj, n=1200):
     s = str(obj)
     return (s[:n] + "…") if len(s) > n else s
 
+def _emit(buf: io.StringIO, line: str):
+    buf.write(line)
+    buf.write("\n")
+
+async def _send_report(update: Update, context: ContextTypes.DEFAULT_TYPE, buf: io.StringIO, filename: str):
+    """Gửi báo cáo: tin nhắn nếu ngắn, file .txt nếu vượt ~3500 ký tự."""
+    if buf.tell() > 3500:
+        await context.bot.send_document(
+            chat_id=update.effective_chat.id,
+            document=buf.getvalue().encode("utf-8"),
+            filename=filename,
+        )
+    else:
+        await update.message.reply_text(buf.getvalue().rstrip("\n"), disable_web_page_preview=True)
+
 # =========================
 # Đọc Excel -> URL
 # =========================
@@ -80,20 +223,84 @@ def _is_excel(doc: Document) -> bool:
     name = (doc.file_name or "").lower()
     return (doc.mime_type in excel_mimes) and name.endswith(".xlsx")
 
+def _xlsx_has_url(path: str) -> bool:
+    """
+    Quét nhanh XML thô trong file .xlsx (zip) xem có ô nào chứa "://" không,
+    để bỏ qua bước đọc workbook khi file không có URL. File lỗi -> True (để parser báo lỗi).
+    """
+    try:
+        with zipfile.ZipFile(path) as z:
+            for name in z.namelist():
+                # Quét mọi part .xml (không phân biệt hoa thường): tên part khác nhau tuỳ
+                # phần mềm tạo file; regex text node đã loại được xmlns nên không báo nhầm
+                if not name.lower().endswith(".xml"):
+                    continue
+                with z.open(name) as f:
+                    tail = b""
+                    for chunk in iter(lambda: f.read(65536), b""):
+                        buf = tail + chunk
+                        if _XLSX_URL_TEXT_RE.search(buf):
+                            return True
+                        # Giữ phần từ thẻ mở cuối cùng để không lỡ match nằm vắt qua 2 chunk
+                        cut = buf.rfind(b"<")
+                        tail = buf[cut:] if cut >= 0 else buf[-131072:]
+    except zipfile.BadZipFile:
+        return True
+    return False
+
+async def _download_telegram_file(context: ContextTypes.DEFAULT_TYPE, file: File, path: str):
+    """Tải file qua session aiohttp dùng chung, ghi đĩa từng chunk 64KB; lỗi thì fallback PTB."""
+    try:
+        session = _get_session(context)
+        async with session.get(file.file_path, timeout=120) as resp:
+            resp.raise_for_status()
+            async with aiofiles.open(path, "wb") as fh:
+                async for chunk in resp.content.iter_chunked(65536):
+                    await fh.write(chunk)
+    except Exception as e:
+        # Không log URL vì file_path chứa bot token
+        logger.warning("Direct download failed (%s), falling back to download_to_drive", type(e).__name__)
+        await file.download_to_drive(path)
+
+def _excel_url_cells(path: str) -> Iterator[str]:
+    """
+    Sinh lần lượt các ô chuỗi có thể chứa URL (có "://", không phân biệt hoa thường như _URL_RE),
+    theo thứ tự sheet -> hàng -> cột.
+    """
+    if CalamineWorkbook is not None:
+        # Đọc thẳng giá trị ô, không dựng DataFrame
+        wb = CalamineWorkbook.from_path(path)
+        for name in wb.sheet_names:
+            for row in wb.get_sheet_by_name(name).iter_rows():
+                for cell in row:
+                    if isinstance(cell, str) and "://" in cell:
+                        yield cell
+        return
+
+    # read_only: đọc stream từng hàng thay vì nạp cả workbook vào bộ nhớ
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            for row in ws.iter_rows(values_only=True):
+                for cell in row:
+                    if isinstance(cell, str) and "://" in cell:
+                        yield cell
+    finally:
+        wb.close()
+
 def extract_urls_from_excel(path: str) -> list[str]:
     """Đọc mọi sheet, mọi cột; gom chuỗi chứa http/https và xác thực nhanh."""
-    dfs = pd.read_excel(path, sheet_name=None, header=None, dtype=str)
-    urls = []
-    url_like = re.compile(r"https?://[^\s<>\"\']+", re.I)
-    for _, df in dfs.items():
-        for val in df.to_numpy().flatten():
-            if isinstance(val, str):
-                for m in url_like.findall(val.strip()):
-                    parsed = urlparse(m)
-                    if parsed.scheme in ("http", "https") and parsed.netloc:
-                        urls.append(m)
-    # dedupe giữ thứ tự
-    return list(dict.fromkeys(urls))
+    if not _xlsx_has_url(path):
+        return []
+    # Nối mọi ô bằng "\n" (không thể nằm trong URL) rồi quét regex một lần;
+    # lọc hợp lệ + dedupe giữ thứ tự gộp chung một vòng qua dict
+    big = "\n".join(_excel_url_cells(path))
+    out: dict[str, None] = {}
+    for m in _URL_RE.finditer(big):
+        u = m.group(0)
+        if u not in out and _URL_VALID_RE.match(u):
+            out[u] = None
+    return list(out)
 
 # =========================
 # Call 1hping
@@ -113,12 +320,12 @@ async def call_1hping_create_campaign(
         "NumberOfDay": number_of_day,
         "Urls": urls,
     }
-    async with session.post(ONEHPING_API_URL, headers=headers, json=payload, timeout=120) as resp:
-        text = await resp.text()
+    async with session.post(ONEHPING_API_URL, headers=headers, data=orjson.dumps(payload), timeout=120) as resp:
+        raw = await resp.read()
         try:
-            data = await resp.json()
-        except Exception:
-            data = {"raw": text}
+            data = orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            data = {"raw": raw.decode("utf-8", errors="replace")}
         return {"status": resp.status, "data": data}
 
 async def call_1hping_in_batches(
@@ -128,26 +335,36 @@ async def call_1hping_in_batches(
     urls: list[str],
     batch_size: int = BATCH_SIZE,
 ) -> list[tuple[str, dict]]:
-    """Gọi API 1hping theo batch. Trả list (campaign_name_used, result_dict)."""
-    results = []
+    """
+    Gọi API 1hping theo batch, song song có giới hạn. Trả list (campaign_name_used, result_dict).
+    Batch lỗi mạng không làm hỏng các batch khác: trả status None và data {"error": ...}.
+    """
     if not urls:
-        return results
+        return []
     parts = list(_chunk(urls, batch_size))
-    for idx, part in enumerate(parts, start=1):
+    sem = asyncio.Semaphore(ONEHPING_CONCURRENCY)
+
+    async def _one(idx: int, part: list[str]) -> tuple[str, dict]:
         name = campaign_name if len(parts) == 1 else f"{campaign_name}__part{idx}"
-        res = await call_1hping_create_campaign(session, name, number_of_day, part)
-        results.append((name, res))
-    return results
+        async with sem:
+            try:
+                return name, await call_1hping_create_campaign(session, name, number_of_day, part)
+            except Exception as e:
+                logger.warning("1hping batch %s failed: %s", name, e)
+                return name, {"status": None, "data": {"error": str(e) or type(e).__name__}}
+
+    return list(await asyncio.gather(*(_one(i, p) for i, p in enumerate(parts, start=1))))
 
 # =========================
 # Sitemap utilities
 # =========================
+@lru_cache(maxsize=1024)
 def _norm_domain(raw: str) -> str:
     """Chuẩn hoá domain người dùng nhập: bỏ scheme/đường dẫn, chỉ giữ host."""
     raw = (raw or "").strip()
     if not raw:
         return ""
-    if not re.match(r"^https?://", raw, flags=re.I):
+    if not _SCHEME_RE.match(raw):
         raw = "http://" + raw
     p = urlparse(raw)
     host = (p.netloc or "").strip().lower()
@@ -169,105 +386,295 @@ def _candidate_sitemap_urls(host: str) -> list[str]:
         ])
     return cands
 
-async def _fetch_bytes(session: aiohttp.ClientSession, url: str) -> bytes | None:
+# Cache sitemap theo URL: (etag, last_modified, body, thời điểm lưu), LRU + TTL
+_SITEMAP_CACHE: OrderedDict[str, tuple[str | None, str | None, bytes, float]] = OrderedDict()
+_SITEMAP_CACHE_TTL = 15 * 60
+_SITEMAP_CACHE_MAX_ENTRIES = 256
+_SITEMAP_CACHE_MAX_BODY = 5 * 1024 * 1024
+_SITEMAP_CACHE_MAX_BYTES = 48 * 1024 * 1024  # trần tổng dung lượng body đang cache
+_sitemap_cache_bytes = 0
+
+def _cache_drop(url: str):
+    global _sitemap_cache_bytes
+    entry = _SITEMAP_CACHE.pop(url, None)
+    if entry is not None:
+        _sitemap_cache_bytes -= len(entry[2])
+
+def _cache_get(url: str) -> tuple[str | None, str | None, bytes, float] | None:
+    entry = _SITEMAP_CACHE.get(url)
+    if entry is None:
+        return None
+    if time.monotonic() - entry[3] > _SITEMAP_CACHE_TTL:
+        _cache_drop(url)
+        return None
+    _SITEMAP_CACHE.move_to_end(url)
+    return entry
+
+def _cache_put(url: str, etag: str | None, last_modified: str | None, body: bytes):
+    global _sitemap_cache_bytes
+    _cache_drop(url)
+    if not (etag or last_modified) or len(body) > _SITEMAP_CACHE_MAX_BODY:
+        return
+    _SITEMAP_CACHE[url] = (etag, last_modified, body, time.monotonic())
+    _sitemap_cache_bytes += len(body)
+    # Loại LRU theo cả số entry lẫn tổng dung lượng
+    while (len(_SITEMAP_CACHE) > _SITEMAP_CACHE_MAX_ENTRIES
+           or _sitemap_cache_bytes > _SITEMAP_CACHE_MAX_BYTES):
+        _cache_drop(next(iter(_SITEMAP_CACHE)))
+
+# Rate limiter theo host để crawl song song không bị origin trả 429
+# (LRU, giữ tối đa _HOST_LIMITERS_MAX host gần nhất)
+_host_limiters: OrderedDict[str, AsyncLimiter] = OrderedDict()
+_HOST_LIMITERS_MAX = 1024
+
+def _host_limiter(url: str) -> AsyncLimiter:
+    host = (urlparse(url).hostname or "").lower()
+    lim = _host_limiters.get(host)
+    if lim is None:
+        lim = _host_limiters[host] = AsyncLimiter(SITEMAP_HOST_RATE, 1)
+        while len(_host_limiters) > _HOST_LIMITERS_MAX:
+            _host_limiters.popitem(last=False)
+    else:
+        _host_limiters.move_to_end(host)
+    return lim
+
+async def _fetch_bytes(session: aiohttp.ClientSession, url: str, rate_limit: bool = True) -> bytes | None:
+    """
+    GET url; gửi If-None-Match / If-Modified-Since nếu đã cache, 304 thì dùng lại body cũ.
+    rate_limit=False khi caller đã tự chờ _host_limiter (vd _fetch_and_parse).
+    """
+    headers = {"User-Agent": CRAWLER_UA}
+    cached = _cache_get(url)
+    if cached:
+        etag, last_modified, _, _ = cached
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
     try:
-        async with session.get(url, headers={"User-Agent": CRAWLER_UA}, timeout=60) as resp:
+        if rate_limit:
+            await _host_limiter(url).acquire()
+        # SKIP_SSL_VERIFY chỉ áp dụng cho crawler; 1hping / Telegram luôn kiểm tra TLS
+        async with session.get(url, headers=headers, timeout=60, ssl=False if SKIP_SSL_VERIFY else True) as resp:
+            if resp.status == 304 and cached:
+                return cached[2]
             if resp.status != 200:
                 return None
-            content = await resp.read()
-            ct = resp.headers.get("Content-Type", "")
-            if url.lower().endswith(".gz") or "gzip" in ct or "application/gzip" in ct:
-                try:
-                    return gzip.decompress(content)
-                except Exception:
-                    return content
-            return content
+            # Content-Encoding gzip/deflate đã được aiohttp giải nén; file .gz giải nén khi parse
+            body = await resp.read()
+            _cache_put(url, resp.headers.get("ETag"), resp.headers.get("Last-Modified"), body)
+            return body
     except Exception as e:
         logger.warning("Fetch error %s: %s", url, e)
         return None
 
-def _xml_findall(root: ET.Element, localname: str) -> list[ET.Element]:
-    return root.findall(f".//{{*}}{localname}")
+def _parse_sitemap_stream(fileobj) -> tuple[list[str], list[str]]:
+    """
+    Parse sitemap dạng stream (iterparse), xoá phần tử đã đọc để bộ nhớ không
+    tăng theo số <url>. Trả về (sitemap_links, page_urls).
+    """
+    sitemap_links, page_urls = [], []
+    try:
+        for _, elem in LET.iterparse(
+            fileobj,
+            events=("end",),
+            tag="{*}loc",
+            huge_tree=True,
+            recover=True,
+            resolve_entities=False,
+        ):
+            parent = elem.getparent()
+            loc = (elem.text or "").strip()
+            if parent is not None and loc:
+                parent_tag = LET.QName(parent).localname
+                if parent_tag == "url":
+                    page_urls.append(loc)
+                elif parent_tag == "sitemap":
+                    sitemap_links.append(loc)
+            elem.clear()
+            # Bỏ các <url>/<sitemap> đã xử lý khỏi cây
+            if parent is not None:
+                while parent.getprevious() is not None:
+                    del parent.getparent()[0]
+    except Exception:
+        pass
+    return sitemap_links, page_urls
 
 def _parse_sitemap_xml(xml_bytes: bytes) -> tuple[list[str], list[str]]:
     """
     Trả về (sitemap_links, page_urls).
     - Nếu là sitemap index: trả về list <sitemap><loc>.
     - Nếu là urlset: trả về list <url><loc>.
+    Đường nhanh: regex trên bytes thô cho sitemap chuẩn; gặp namespace prefix,
+    CDATA hay cấu trúc lạ thì fallback sang iterparse.
     """
+    head = xml_bytes[:4096]
+    is_index = b"<sitemapindex" in head
+    if is_index or b"<urlset" in head:
+        locs = [m.group(1) for m in _LOC_RE.finditer(xml_bytes)]
+        # Mọi thẻ <loc phải khớp regex, nếu không (CDATA, <location>...) thì parse đầy đủ
+        if locs and len(locs) == xml_bytes.count(b"<loc"):
+            out = []
+            for raw in locs:
+                loc = raw.decode("utf-8", errors="replace")
+                if "&" in loc:
+                    loc = _xml_unescape(loc)
+                    if loc is None:
+                        break  # '&' trần / tham chiếu lỗi: để lxml xử lý cả file
+                out.append(loc)
+            else:
+                return (out, []) if is_index else ([], out)
+    # '&' trần (XML lỗi, hay gặp trong query string): escape thành &amp; để lxml không nuốt
+    # mất "&notify=2" như một entity lạ; nội dung CDATA giữ nguyên
+    if b"&" in xml_bytes:
+        xml_bytes = _XML_BARE_AMP_BYTES_RE.sub(lambda m: m.group(1) or b"&amp;", xml_bytes)
+    return _parse_sitemap_stream(io.BytesIO(xml_bytes))
+
+def _parse_sitemap_gz(data: bytes) -> tuple[list[str], list[str]]:
+    """.xml.gz: giải nén rồi đi chung đường với sitemap thường (đường nhanh + escape '&' trần)."""
     try:
-        root = ET.fromstring(xml_bytes)
-    except Exception:
+        xml_bytes = gzip.decompress(data)
+    except (OSError, EOFError, zlib.error):
         return [], []
+    return _parse_sitemap_xml(xml_bytes)
 
-    sitemap_links, page_urls = [], []
+def _xml_unescape(text: str) -> str | None:
+    """Giải mã entity theo luật XML (không phải HTML5). Trả None nếu có '&' không hợp lệ."""
+    if _XML_BARE_AMP_RE.search(text):
+        return None
+
+    def _rep(m: re.Match) -> str:
+        if m.group(1):
+            return _XML_NAMED_ENTITIES[m.group(1)]
+        return chr(int(m.group(2)) if m.group(2) else int(m.group(3), 16))
 
-    for sm in _xml_findall(root, "sitemap"):
-        loc_el = sm.find("{*}loc")
-        if loc_el is not None and (loc := (loc_el.text or "").strip()):
-            sitemap_links.append(loc)
+    try:
+        return _XML_ENTITY_RE.sub(_rep, text)
+    except (ValueError, OverflowError):
+        return None
 
-    for u in _xml_findall(root, "url"):
-        loc_el = u.find("{*}loc")
-        if loc_el is not None and (loc := (loc_el.text or "").strip()):
-            page_urls.append(loc)
+# Sitemap lớn hơn ngưỡng này được parse trong thread để không chặn event loop
+_PARSE_IN_THREAD_BYTES = 256 * 1024
 
-    return sitemap_links, page_urls
+# Giới hạn tổng số sitemap đang tải cùng lúc trên mọi lệnh (vd /indexdomains chạy nhiều domain)
+_SITEMAP_GLOBAL_SEM = asyncio.Semaphore(SITEMAP_GLOBAL_CONCURRENCY)
+
+async def _fetch_and_parse(
+    session: aiohttp.ClientSession,
+    url: str,
+    sem: asyncio.Semaphore,
+) -> tuple[str, list[str], list[str]]:
+    """Tải + parse một sitemap trong giới hạn semaphore. Trả (url, child_sitemaps, page_urls)."""
+    async with sem:
+        # Chờ rate limit của host trước khi giữ slot chung, để host bị throttle không chiếm slot của người khác
+        await _host_limiter(url).acquire()
+        async with _SITEMAP_GLOBAL_SEM:
+            data = await _fetch_bytes(session, url, rate_limit=False)
+    if not data:
+        return url, [], []
+    if url.lower().endswith(".gz") and data[:2] == b"\x1f\x8b":
+        # .gz: kích thước sau giải nén không biết trước nên luôn giải nén + parse trong thread
+        child_sitemaps, page_urls = await asyncio.to_thread(_parse_sitemap_gz, data)
+    elif len(data) > _PARSE_IN_THREAD_BYTES:
+        child_sitemaps, page_urls = await asyncio.to_thread(_parse_sitemap_xml, data)
+    else:
+        child_sitemaps, page_urls = _parse_sitemap_xml(data)
+    return url, child_sitemaps, page_urls
+
+def _site_key(url: str) -> str:
+    """Host bỏ tiền tố www., dùng so sánh cùng site (abc.com == www.abc.com)."""
+    host = (urlparse(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
 
 async def _collect_urls_from_sitemaps(
     session: aiohttp.ClientSession,
     entry_urls: list[str],
     limit_depth: int = 6,
+    max_urls: int = SITEMAP_MAX_URLS,
+    max_sitemaps: int = SITEMAP_MAX_SITEMAPS,
 ) -> list[str]:
-    """Duyệt đệ quy sitemap index -> sitemap con -> urlset, loại trùng, giữ thứ tự."""
+    """
+    Duyệt đệ quy sitemap index -> sitemap con -> urlset, loại trùng, giữ thứ tự.
+    Dừng sớm khi chạm max_urls / max_sitemaps để giới hạn bộ nhớ và thời gian.
+    Sitemap con khác host với sitemap cha bị bỏ qua (chống chuyển hướng crawl sang site khác).
+    """
     seen_sitemaps = set()
-    seen_urls = set()
-    ordered_urls = []
+    seen_urls: dict[str, None] = {}  # dict dùng như ordered set
 
-    queue = list(entry_urls)
+    queue = list(dict.fromkeys(entry_urls))
     depth = 0
+    sem = asyncio.Semaphore(SITEMAP_CONCURRENCY)
 
     while queue and depth < limit_depth:
-        next_queue = []
-        for sm_url in queue:
-            if sm_url in seen_sitemaps:
-                continue
-            seen_sitemaps.add(sm_url)
-
-            data = await _fetch_bytes(session, sm_url)
-            if not data:
-                continue
-
-            child_sitemaps, page_urls = _parse_sitemap_xml(data)
+        if len(seen_sitemaps) >= max_sitemaps:
+            logger.warning("Sitemap cap reached (%d sitemaps), stopping crawl", max_sitemaps)
+            break
 
+        next_queue = []
+        next_queue_set = set()
+        # Đánh dấu seen trước khi gather để các task song song không tải trùng
+        todo = [u for u in queue if u not in seen_sitemaps][:max_sitemaps - len(seen_sitemaps)]
+        seen_sitemaps.update(todo)
+
+        # Tải song song cả tầng, sau đó gộp tuần tự theo thứ tự queue để giữ thứ tự URL
+        results = await asyncio.gather(*(_fetch_and_parse(session, u, sem) for u in todo))
+        for sm_url, child_sitemaps, page_urls in results:
             for u in page_urls:
-                if u not in seen_urls:
-                    seen_urls.add(u)
-                    ordered_urls.append(u)
+                seen_urls[u] = None
+                if len(seen_urls) >= max_urls:
+                    logger.warning("URL cap reached (%d URLs), stopping crawl", max_urls)
+                    return list(seen_urls)
 
+            parent_site = _site_key(sm_url)
             for c in child_sitemaps:
-                if c not in seen_sitemaps:
+                if _site_key(c) != parent_site:
+                    logger.info("Skip cross-origin child sitemap %s (parent %s)", c, sm_url)
+                    continue
+                if c not in seen_sitemaps and c not in next_queue_set:
                     next_queue.append(c)
+                    next_queue_set.add(c)
 
         queue = next_queue
         depth += 1
 
-    return ordered_urls
+    return list(seen_urls)
+
+async def _sitemaps_from_robots(session: aiohttp.ClientSession, host: str) -> list[str]:
+    """
+    Đọc các dòng `Sitemap:` trong robots.txt của host và www.host (ưu tiên https).
+    Các biến thể được tải song song, lấy kết quả đầu tiên theo thứ tự ưu tiên.
+    """
+    hosts = [host] if host.startswith("www.") else [host, "www." + host]
+    urls = [f"{scheme}://{h}/robots.txt" for scheme in ("https", "http") for h in hosts]
+    results = await asyncio.gather(*(_fetch_bytes(session, u) for u in urls))
+    for data in results:
+        if not data:
+            continue
+        text = data.decode("utf-8", errors="replace")
+        sitemaps = _ROBOTS_SITEMAP_RE.findall(text)
+        if sitemaps:
+            return list(dict.fromkeys(sitemaps))
+    return []
 
 async def _discover_sitemap_entry_points(session: aiohttp.ClientSession, host: str) -> list[str]:
-    """Thử tải các URL sitemap phổ biến, trả về entry points (index hoặc urlset)."""
+    """Lấy sitemap từ robots.txt; nếu không có thì thử các URL sitemap phổ biến."""
+    robots_sitemaps = await _sitemaps_from_robots(session, host)
+    if robots_sitemaps:
+        return robots_sitemaps
+
     candidates = _candidate_sitemap_urls(host)
     entry_points = []
 
-    for url in candidates:
-        data = await _fetch_bytes(session, url)
-        if not data:
-            continue
-        child_sitemaps, page_urls = _parse_sitemap_xml(data)
+    # Thử tất cả ứng viên cùng lúc, rồi chọn kết quả đầu tiên theo thứ tự ưu tiên
+    sem = asyncio.Semaphore(SITEMAP_CONCURRENCY)
+    results = await asyncio.gather(*(_fetch_and_parse(session, u, sem) for u in candidates))
 
+    for url, child_sitemaps, page_urls in results:
         if child_sitemaps:
             entry_points.append(url)
-            entry_points.extend(child_sitemaps)
+            # Cùng bộ lọc cross-origin như _collect_urls_from_sitemaps
+            site = _site_key(url)
+            entry_points.extend(c for c in child_sitemaps if _site_key(c) == site)
             break
         elif page_urls:
             entry_points.append(url)
@@ -293,7 +700,7 @@ HELP_TEXT = (
 )
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data.clear()
+    _clear_session(context)
     msg = (
         "Chào bạn. Gửi **file Excel (.xlsx)** chứa list URL cần ép index.\n"
         "Hoặc dùng:\n"
@@ -309,7 +716,7 @@ async def help_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(HELP_TEXT, disable_web_page_preview=True)
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data.clear()
+    _clear_session(context)
     await update.message.reply_text("Đã hủy và xóa trạng thái. Gửi lại file Excel hoặc dùng /indexweb, /indexdomains.")
 
 # ===== Handlers: Excel -> hỏi số ngày -> gọi API =====
@@ -319,16 +726,17 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Vui lòng gửi **file Excel (.xlsx)**. Các định dạng khác không được hỗ trợ.")
         return
 
-    await send_typing(context, update.effective_chat.id)
+    send_typing_bg(context, update.effective_chat.id)
 
     # Tải file tạm
     try:
         with tempfile.TemporaryDirectory() as tmpdir:
             path = os.path.join(tmpdir, doc.file_name or "urls.xlsx")
             file = await context.bot.get_file(doc.file_id)
-            await file.download_to_drive(path)
+            await _download_telegram_file(context, file, path)
 
-            urls = extract_urls_from_excel(path)
+            # Đọc workbook chạy đồng bộ, đẩy sang thread để không chặn event loop
+            urls = await asyncio.to_thread(extract_urls_from_excel, path)
     except Exception as e:
         logger.exception("Error while reading excel")
         await update.message.reply_text(f"Lỗi đọc file Excel: {e}")
@@ -338,7 +746,7 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Không tìm thấy URL hợp lệ (http/https) trong file. Kiểm tra lại nội dung.")
         return
 
-    context.user_data["urls"] = urls
+    await _store_urls(context, urls)
     context.user_data["awaiting_days"] = True
 
     await update.message.reply_text(
@@ -352,11 +760,12 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     raw = (update.message.text or "").strip()
-    if not re.fullmatch(r"\d{1,3}", raw):
+    try:
+        days = int(raw)
+    except ValueError:
         await update.message.reply_text("Vui lòng nhập **số nguyên hợp lệ** cho số ngày (ví dụ: 1, 3, 7).")
         return
 
-    days = int(raw)
     if days <= 0:
         await update.message.reply_text("Số ngày phải >= 1.")
         return
@@ -364,10 +773,10 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Giới hạn tối đa 365 ngày.")
         return
 
-    urls = context.user_data.get("urls", [])
+    urls = await _load_urls(context)
     if not urls:
         await update.message.reply_text("Không tìm thấy danh sách URL trong phiên. Gửi lại file Excel hoặc dùng /indexweb.")
-        context.user_data.clear()
+        _clear_session(context)
         return
 
     tg_user = update.effective_user
@@ -375,7 +784,6 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = tg_user.id
     campaign_name = sanitize_campaign_name(f"{display_name}_{user_id}")
 
-    await send_typing(context, update.effective_chat.id)
     await update.message.reply_text(
         f"Đang tạo chiến dịch:\n"
         f"• Tên: `{campaign_name}`\n"
@@ -384,40 +792,30 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"Vui lòng đợi kết quả...",
         disable_web_page_preview=True,
     )
+    send_typing_bg(context, update.effective_chat.id)
 
     try:
-        timeout = aiohttp.ClientTimeout(total=180)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            results = await call_1hping_in_batches(session, campaign_name, days, urls, batch_size=BATCH_SIZE)
+        session = _get_session(context)
+        results = await call_1hping_in_batches(session, campaign_name, days, urls, batch_size=BATCH_SIZE)
     except Exception as e:
         logger.exception("Error calling 1hping API")
         await update.message.reply_text(f"Lỗi gọi API 1hping: {e}")
-        context.user_data.clear()
+        _clear_session(context)
         return
 
-    lines = [f"✅ Kết quả tạo {len(results)} campaign:"]
+    ok_count = sum(1 for _, r in results if r.get("status") and 200 <= r["status"] < 300)
+    buf = io.StringIO()
+    _emit(buf, f"✅ Kết quả tạo {len(results)} campaign ({ok_count} thành công, {len(results) - ok_count} lỗi):")
     for name, r in results:
         status = r.get("status")
         data = r.get("data")
         ok = (status and 200 <= status < 300)
         prefix = "• ✅" if ok else "• ❌"
-        lines.append(f"{prefix} {name} — HTTP {status} — {_short(data)}")
-
-    text = "\n".join(lines)
-    if len(text) > 3500:
-        with tempfile.NamedTemporaryFile("w+", delete=False, suffix=".txt") as tf:
-            tf.write(text)
-            tf.flush()
-            fname = tf.name
-        await context.bot.send_document(chat_id=update.effective_chat.id, document=open(fname, "rb"), filename="index_result.txt")
-        try:
-            os.remove(fname)
-        except Exception:
-            pass
-    else:
-        await update.message.reply_text(text, disable_web_page_preview=True)
+        _emit(buf, f"{prefix} {name} — HTTP {status} — {_short(data)}")
 
-    context.user_data.clear()
+    await _send_report(update, context, buf, "index_result.txt")
+
+    _clear_session(context)
 
 async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Không hiểu lệnh. Gửi file Excel (.xlsx) hoặc dùng /indexweb, /indexdomains hoặc /help.")
@@ -435,21 +833,19 @@ async def indexweb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Domain không hợp lệ. Vui lòng thử lại, ví dụ: `/indexweb abc.com`")
         return
 
-    await send_typing(context, update.effective_chat.id)
     await update.message.reply_text(
         f"Đang dò sitemap cho `{host}` (ưu tiên https{' — bỏ qua SSL' if SKIP_SSL_VERIFY else ''})...",
         disable_web_page_preview=True
     )
+    send_typing_bg(context, update.effective_chat.id)
 
-    timeout = aiohttp.ClientTimeout(total=300)
-    connector = aiohttp.TCPConnector(ssl=not SKIP_SSL_VERIFY)
+    session = _get_session(context)
     try:
-        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
-            entry_points = await _discover_sitemap_entry_points(session, host)
-            if not entry_points:
-                await update.message.reply_text("Không tìm thấy sitemap hợp lệ (sitemap_index.xml / sitemap.xml).")
-                return
-            urls = await _collect_urls_from_sitemaps(session, entry_points, limit_depth=6)
+        entry_points = await _discover_sitemap_entry_points(session, host)
+        if not entry_points:
+            await update.message.reply_text("Không tìm thấy sitemap hợp lệ (sitemap_index.xml / sitemap.xml).")
+            return
+        urls = await _collect_urls_from_sitemaps(session, entry_points, limit_depth=6)
     except Exception as e:
         logger.exception("Error while indexing web via sitemap")
         await update.message.reply_text(f"Lỗi khi quét sitemap: {e}")
@@ -459,13 +855,12 @@ async def indexweb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Không thu thập được URL nào từ sitemap.")
         return
 
-    # dedupe
-    deduped = list(dict.fromkeys(urls))
-    context.user_data["urls"] = deduped
+    # _collect_urls_from_sitemaps đã loại trùng
+    await _store_urls(context, urls)
     context.user_data["awaiting_days"] = True
 
     await update.message.reply_text(
-        f"Đã thu thập **{len(deduped)} URL** từ sitemap `{host}`.\n"
+        f"Đã thu thập **{len(urls)} URL** từ sitemap `{host}`.\n"
         f"Bạn muốn chia ép trong **bao nhiêu ngày**? (nhập số nguyên, ví dụ: 1, 3, 7)"
     )
 
@@ -475,18 +870,12 @@ def _parse_domains_raw(raw_tokens: list[str]) -> list[str]:
     for t in raw_tokens:
         if not t:
             continue
-        for piece in re.split(r"[,\n\r]+", t):
+        for piece in _SPLIT_RE.split(t):
             p = piece.strip()
             if p:
                 out.append(p)
     # dedupe giữ thứ tự
-    seen = set()
-    deduped = []
-    for d in out:
-        if d not in seen:
-            seen.add(d)
-            deduped.append(d)
-    return deduped
+    return list(dict.fromkeys(out))
 
 async def indexdomains(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -507,7 +896,7 @@ async def indexdomains(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     days = 1
     tokens = list(args)
-    if re.fullmatch(r"\d{1,4}", tokens[0]):
+    if _DAYS4_RE.fullmatch(tokens[0]):
         days = int(tokens.pop(0))
         if days <= 0:
             await update.message.reply_text("Số ngày phải >= 1.")
@@ -521,16 +910,15 @@ async def indexdomains(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Không có domain hợp lệ trong tin nhắn.")
         return
 
-    await send_typing(context, update.effective_chat.id)
     await update.message.reply_text(
         f"Nhận {len(domains)} domain. Bắt đầu quét sitemap và tạo campaign trong {days} ngày...\n"
         f"(Chạy song song tối đa 3 domain mỗi lần; SSL {'bỏ qua' if SKIP_SSL_VERIFY else 'bật kiểm tra'})",
         disable_web_page_preview=True
     )
+    send_typing_bg(context, update.effective_chat.id)
 
     sem = asyncio.Semaphore(3)
-    timeout = aiohttp.ClientTimeout(total=300)
-    connector = aiohttp.TCPConnector(ssl=not SKIP_SSL_VERIFY)
+    session = _get_session(context)
 
     async def _process_domain(domain: str) -> tuple[str, dict]:
         async with sem:
@@ -541,20 +929,18 @@ async def indexdomains(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return domain, report
 
             try:
-                async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
-                    entry_points = await _discover_sitemap_entry_points(session, host)
-                    if not entry_points:
-                        report["error"] = "Không tìm thấy sitemap hợp lệ"
-                        return domain, report
-                    urls = await _collect_urls_from_sitemaps(session, entry_points, limit_depth=6)
+                entry_points = await _discover_sitemap_entry_points(session, host)
+                if not entry_points:
+                    report["error"] = "Không tìm thấy sitemap hợp lệ"
+                    return domain, report
+                urls = await _collect_urls_from_sitemaps(session, entry_points, limit_depth=6)
             except Exception as e:
                 logger.exception("Error while processing domain %s", domain)
                 report["error"] = f"Lỗi khi quét sitemap: {e}"
                 return domain, report
 
-            deduped = list(dict.fromkeys(urls))
-            report["urls_count"] = len(deduped)
-            if not deduped:
+            report["urls_count"] = len(urls)
+            if not urls:
                 report["error"] = "Không thu thập được URL từ sitemap"
                 return domain, report
 
@@ -564,8 +950,7 @@ async def indexdomains(update: Update, context: ContextTypes.DEFAULT_TYPE):
             base_campaign_name = sanitize_campaign_name(f"{display_name}_{user_id}_{host}")
 
             try:
-                async with aiohttp.ClientSession(timeout=timeout) as session:
-                    batch_results = await call_1hping_in_batches(session, base_campaign_name, days, deduped, batch_size=BATCH_SIZE)
+                batch_results = await call_1hping_in_batches(session, base_campaign_name, days, urls, batch_size=BATCH_SIZE)
             except Exception as e:
                 logger.exception("Error calling 1hping for domain %s", domain)
                 report["error"] = f"Lỗi gọi API 1hping: {e}"
@@ -582,36 +967,78 @@ async def indexdomains(update: Update, context: ContextTypes.DEFAULT_TYPE):
     tasks = [asyncio.create_task(_process_domain(d)) for d in domains]
     results = await asyncio.gather(*tasks, return_exceptions=False)
 
-    lines = []
+    buf = io.StringIO()
     for domain, rep in results:
         if rep.get("error"):
-            lines.append(f"• {domain} — ❌ {rep['error']}")
+            _emit(buf, f"• {domain} — ❌ {rep['error']}")
         else:
-            lines.append(f"• {domain} — ✅ URLs: {rep['urls_count']} — Campaigns: {len(rep['campaigns'])}")
+            _emit(buf, f"• {domain} — ✅ URLs: {rep['urls_count']} — Campaigns: {len(rep['campaigns'])}")
             for c in rep["campaigns"]:
                 status = c.get("status")
                 preview = c.get("data_preview") or ""
-                lines.append(f"    - {c['name']} — HTTP {status} — {preview}")
-
-    text = "\n".join(lines)
-    if len(text) > 3500:
-        with tempfile.NamedTemporaryFile("w+", delete=False, suffix=".txt") as tf:
-            tf.write(text)
-            tf.flush()
-            fname = tf.name
-        await context.bot.send_document(chat_id=update.effective_chat.id, document=open(fname, "rb"), filename="indexdomains_result.txt")
-        try:
-            os.remove(fname)
-        except Exception:
-            pass
-    else:
-        await update.message.reply_text(text, disable_web_page_preview=True)
+                _emit(buf, f"    - {c['name']} — HTTP {status} — {preview}")
+
+    await _send_report(update, context, buf, "indexdomains_result.txt")
 
 # =========================
 # Entry
 # =========================
+async def _post_init(app: Application):
+    """
+    Tạo một ClientSession dùng chung cho toàn bộ vòng đời bot (keep-alive, pool TLS)
+    và thư mục tạm riêng chứa file URL của các phiên.
+    """
+    _sweep_stale_urls_files()
+    app.bot_data["urls_dir"] = tempfile.TemporaryDirectory(prefix=_URLS_TMP_PREFIX)
+    resolver_kwargs = {}
+    if HAS_AIODNS:
+        resolver = aiohttp.AsyncResolver(nameservers=DNS_NAMESERVERS or None)
+        resolver_kwargs = {"resolver": resolver}
+    app.bot_data["session"] = aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=300),
+        headers={"Accept-Encoding": "gzip, deflate"},  # aiohttp tự giải nén (auto_decompress)
+        raise_for_status=False,  # các nhánh lỗi tự kiểm tra resp.status
+        connector=aiohttp.TCPConnector(
+            limit=100,
+            limit_per_host=16,
+            use_dns_cache=True,
+            ttl_dns_cache=300,
+            keepalive_timeout=60,
+            enable_cleanup_closed=True,
+            force_close=False,
+            **resolver_kwargs,
+        ),
+    )
+
+async def _post_shutdown(app: Application):
+    session = app.bot_data.pop("session", None)
+    if session is not None and not session.closed:
+        await session.close()
+    urls_dir = app.bot_data.pop("urls_dir", None)
+    if urls_dir is not None:
+        urls_dir.cleanup()
+
+def _install_uvloop():
+    """Dùng uvloop (libuv) làm event loop nếu có; Windows không hỗ trợ nên bỏ qua."""
+    if sys.platform == "win32":
+        return
+    try:
+        import uvloop
+    except ImportError:
+        return
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    logger.info("Using uvloop event loop")
+
 def main():
-    app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    _install_uvloop()
+    app = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .http_version("2")  # nhiều lời gọi Bot API dồn chung một kết nối TCP/TLS
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
+        .build()
+    )
 
     # Menu
     app.add_handler(CommandHandler("start", start))